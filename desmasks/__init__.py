@@ -1,6 +1,10 @@
+from . import profiling
+
 from . import masks
 from .masks import (
     load_tile_mask,
+    iter_tile_masks,
+    get_pixels,
     TileMask,
 )
 from . import objmasks
@@ -12,6 +16,7 @@ from .loadmasks import (
     read_bleeds,
     read_tile_geom,
     read_imgdata,
+    read_trimmed_imgdata,
     load_circles,
     load_polygons,
     get_trimmed_tile_geom,
@@ -22,3 +27,9 @@ from .loadreg import load_regions
 
 from . import plotting
 from .plotting import plot_by_val, plotrand
+
+from . import maskops
+from .maskops import or_masks, and_masks, intersect_bounds, diff_masks
+
+from . import columnar
+from .columnar import iter_record_batches, write_parquet
@@ -0,0 +1,155 @@
+"""
+write masked catalogs as arrow record batches or parquet files
+
+pyarrow is only imported when these functions are called
+"""
+
+import numpy as np
+
+DEFAULT_CHUNKSIZE = 1_000_000
+
+
+def iter_record_batches(mask,
+                        data,
+                        ra_name='ra',
+                        dec_name='dec',
+                        columns=None,
+                        chunksize=DEFAULT_CHUNKSIZE,
+                        drop_masked=False):
+    """
+    iterate over a catalog in chunks, yielding arrow record batches with
+    the mask_flags and is_masked columns added
+
+    Contiguous numeric columns in native byte order are passed to arrow
+    without copying.  Fields of a structured array are strided and are
+    copied one chunk at a time
+
+    Parameters
+    ----------
+    mask: TileMask
+        A TileMask or object with that interface.  If it has an
+        is_in_bounds method, is_masked is derived from the flags and
+        bounds rather than looked up again
+    data: array with fields or dict of arrays
+        The catalog
+    ra_name: string, optional
+        Name of the ra column, default 'ra'
+    dec_name: string, optional
+        Name of the dec column, default 'dec'
+    columns: list of strings, optional
+        Columns to write, default all
+    chunksize: int, optional
+        Number of rows in each batch before filtering, default 1_000_000
+    drop_masked: bool, optional
+        If True, drop masked rows before they are converted
+
+    Yields
+    ------
+    pyarrow.RecordBatch
+    """
+    import pyarrow as pa
+
+    if columns is None:
+        if hasattr(data, 'dtype'):
+            columns = list(data.dtype.names)
+        else:
+            columns = list(data.keys())
+
+    ra = data[ra_name]
+    dec = data[dec_name]
+    nrows = len(ra)
+
+    # always yield at least one batch so the schema is available
+    for start in range(0, max(nrows, 1), chunksize):
+        end = min(start + chunksize, nrows)
+
+        cra = ra[start:end]
+        cdec = dec[start:end]
+        mask_flags = mask.get_mask_flags(cra, cdec)
+        if hasattr(mask, 'is_in_bounds'):
+            # avoid a second lookup in the mask map
+            is_masked = (mask_flags > 0) | ~mask.is_in_bounds(cra, cdec)
+        else:
+            is_masked = mask.is_masked(cra, cdec)
+
+        if drop_masked:
+            keep, = np.where(~is_masked)
+            mask_flags = mask_flags[keep]
+            is_masked = is_masked[keep]
+        else:
+            keep = slice(None)
+
+        arrays = []
+        for name in columns:
+            arrays.append(_to_arrow(data[name][start:end][keep]))
+
+        arrays.append(_to_arrow(mask_flags))
+        arrays.append(_to_arrow(is_masked))
+
+        yield pa.RecordBatch.from_arrays(
+            arrays,
+            names=columns + ['mask_flags', 'is_masked'],
+        )
+
+
+def write_parquet(fname,
+                  mask,
+                  data,
+                  row_group_size=DEFAULT_CHUNKSIZE,
+                  compression='snappy',
+                  **kw):
+    """
+    write a catalog with mask columns to a parquet file, one row group
+    per chunk
+
+    Parameters
+    ----------
+    fname: string
+        File to write
+    mask: TileMask
+        A TileMask or object with that interface
+    data: array with fields or dict of arrays
+        The catalog
+    row_group_size: int, optional
+        Number of rows in each chunk before filtering, default 1_000_000
+    compression: string, optional
+        Parquet compression, default 'snappy'
+    **kw:
+        Other keywords for iter_record_batches, e.g. columns and
+        drop_masked
+    """
+    import pyarrow.parquet as pq
+
+    batches = iter_record_batches(mask, data, chunksize=row_group_size, **kw)
+
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    fname, batch.schema, compression=compression,
+                )
+
+            if batch.num_rows > 0:
+                writer.write_batch(batch, row_group_size=row_group_size)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _to_arrow(arr):
+    """
+    convert a numpy array to arrow, without copying when possible
+    """
+    import pyarrow as pa
+
+    arr = np.asarray(arr)
+    if not arr.dtype.isnative:
+        arr = arr.astype(arr.dtype.newbyteorder('='))
+
+    if arr.ndim > 1:
+        nper = int(np.prod(arr.shape[1:]))
+        flat = np.ascontiguousarray(arr).reshape(-1)
+        return pa.FixedSizeListArray.from_arrays(pa.array(flat), nper)
+
+    return pa.array(arr)
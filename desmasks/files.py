@@ -1,16 +1,20 @@
 import os
+import re
+import numpy as np
+from . import profiling
+
+# cache of {basename: size} for each mask directory scanned
+_dir_cache = {}
+
+# reqnum/attnum suffix such as _r3688p01
+_REQNUM_RE = re.compile(r'_r[0-9]+p[0-9]+$')
 
 
 def _extract_mask_tilename(tilename_full):
     """
     mask files don't have reqnum/attnum
     """
-    if '_r' in tilename_full:
-        tilename = '_'.join(tilename_full.split('_')[0:2])
-    else:
-        tilename = tilename_full
-
-    return tilename
+    return _REQNUM_RE.sub('', tilename_full)
 
 
 def get_mask_dir():
@@ -25,6 +29,7 @@ def get_mask_dir():
     )
 
 
+@profiling.timed('files.get_mask_file')
 def get_mask_file(tilename_full, with_uvista=False):
     """
     get the mask file name.
@@ -36,19 +41,10 @@ def get_mask_file(tilename_full, with_uvista=False):
         or with reqnum/attnum SN-C3_C10_r3688p01
     """
     d = get_mask_dir()
-
-    # without reqnum etc.
-    mask_tilename = _extract_mask_tilename(tilename_full)
-
-    fname = os.path.join(d, '%s-griz-healsparse.fits' % mask_tilename)
-    if with_uvista:
-        assert 'COSMOS' in tilename_full, \
-            'ultravista is only in COSMOS'
-
-        fname = fname.replace('.fits', '-UV.fits')
-    return fname
+    return os.path.join(d, _get_mask_basename(tilename_full, with_uvista))
 
 
+@profiling.timed('files.get_bounds_file')
 def get_bounds_file(tilename_full):
     """
     get the healsparse bounds map file name.
@@ -60,8 +56,188 @@ def get_bounds_file(tilename_full):
         or with reqnum/attnum SN-C3_C10_r3688p01
     """
     d = get_mask_dir()
+    return os.path.join(d, _get_bounds_basename(tilename_full))
+
+
+@profiling.timed('files.get_mask_files')
+def get_mask_files(tilenames_full, with_uvista=False):
+    """
+    get the mask file names for a set of tiles.  The environment is read
+    once and each unique tilename is processed only once
+
+    Parameters
+    ----------
+    tilenames: sequence of strings
+        Either the basic tilenames such as SN-C3_C10
+        or with reqnum/attnum SN-C3_C10_r3688p01
+    with_uvista: bool, optional
+        If True, get the file names for masks including UltraVISTA
+
+    Returns
+    -------
+    array of file names
+    """
+    return _get_files(
+        tilenames_full,
+        lambda t: _get_mask_basename(t, with_uvista),
+    )
+
+
+@profiling.timed('files.get_bounds_files')
+def get_bounds_files(tilenames_full):
+    """
+    get the healsparse bounds map file names for a set of tiles.  The
+    environment is read once and each unique tilename is processed only
+    once
+
+    Parameters
+    ----------
+    tilenames: sequence of strings
+        Either the basic tilenames such as SN-C3_C10
+        or with reqnum/attnum SN-C3_C10_r3688p01
+
+    Returns
+    -------
+    array of file names
+    """
+    return _get_files(tilenames_full, _get_bounds_basename)
+
+
+def scan_mask_dir(refresh=False):
+    """
+    get the names and sizes of all files in the mask directory.  The
+    directory is scanned once and the result cached for each MEDS_DIR
+
+    Parameters
+    ----------
+    refresh: bool, optional
+        If True, rescan the directory even if it was cached
 
+    Returns
+    -------
+    dict keyed by basename with the file size in bytes
+    """
+    d = get_mask_dir()
+
+    sizes = _dir_cache.get(d)
+    if sizes is None or refresh:
+        sizes = {}
+        with profiling.timer('files.scan_mask_dir'):
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_file():
+                        sizes[entry.name] = entry.stat().st_size
+
+        _dir_cache[d] = sizes
+
+    return sizes
+
+
+@profiling.timed('files.resolve_tile_files')
+def resolve_tile_files(tilenames_full,
+                       with_uvista=False,
+                       require=True,
+                       refresh=False):
+    """
+    resolve mask and bounds files for a set of tiles and check that they
+    exist, using a single cached scan of the mask directory
+
+    Parameters
+    ----------
+    tilenames: sequence of strings
+        Either the basic tilenames such as SN-C3_C10
+        or with reqnum/attnum SN-C3_C10_r3688p01
+    with_uvista: bool, optional
+        If True, get the file names for masks including UltraVISTA
+    require: bool, optional
+        If True, raise FileNotFoundError if any files are missing,
+        default True
+    refresh: bool, optional
+        If True, rescan the mask directory even if it was cached
+
+    Returns
+    -------
+    array with fields tilename, mask_file, bounds_file, mask_size
+    and bounds_size.  The sizes are -1 for missing files
+    """
+    tilenames_full = np.array(tilenames_full, ndmin=1, dtype='U')
+
+    mask_files = get_mask_files(tilenames_full, with_uvista=with_uvista)
+    bounds_files = get_bounds_files(tilenames_full)
+    sizes = scan_mask_dir(refresh=refresh)
+
+    output = np.zeros(
+        tilenames_full.size,
+        dtype=[
+            ('tilename', tilenames_full.dtype),
+            ('mask_file', mask_files.dtype),
+            ('bounds_file', bounds_files.dtype),
+            ('mask_size', 'i8'),
+            ('bounds_size', 'i8'),
+        ],
+    )
+    output['tilename'] = tilenames_full
+    output['mask_file'] = mask_files
+    output['bounds_file'] = bounds_files
+    output['mask_size'] = _get_sizes(mask_files, sizes)
+    output['bounds_size'] = _get_sizes(bounds_files, sizes)
+
+    if require:
+        missing = np.concatenate([
+            mask_files[output['mask_size'] < 0],
+            bounds_files[output['bounds_size'] < 0],
+        ])
+        if missing.size > 0:
+            raise FileNotFoundError(
+                'missing %d mask files: %s' % (
+                    missing.size, ', '.join(missing[:10]),
+                )
+            )
+
+    return output
+
+
+def _get_mask_basename(tilename_full, with_uvista):
+    # without reqnum etc.
+    mask_tilename = _extract_mask_tilename(tilename_full)
+
+    if with_uvista:
+        assert 'COSMOS' in tilename_full, \
+            'ultravista is only in COSMOS'
+
+        return '%s-griz-healsparse-UV.fits' % mask_tilename
+    else:
+        return '%s-griz-healsparse.fits' % mask_tilename
+
+
+def _get_bounds_basename(tilename_full):
     # without reqnum etc.
     mask_tilename = _extract_mask_tilename(tilename_full)
+    return '%s-griz-bounds-healsparse.fits' % mask_tilename
+
+
+def _get_files(tilenames_full, get_basename):
+    """
+    get the full paths, calling get_basename once per unique tilename
+    """
+    d = get_mask_dir()
+
+    utilenames, rev = np.unique(
+        np.array(tilenames_full, ndmin=1, dtype='U'),
+        return_inverse=True,
+    )
+    ufiles = np.array(
+        [os.path.join(d, get_basename(t)) for t in utilenames],
+        dtype='U',
+    )
+    return ufiles[rev]
 
-    return os.path.join(d, '%s-griz-bounds-healsparse.fits' % mask_tilename)
+
+def _get_sizes(fnames, sizes):
+    """
+    look up the sizes of the files in the scanned directory, -1 if missing
+    """
+    return np.array(
+        [sizes.get(os.path.basename(f), -1) for f in fnames],
+        dtype='i8',
+    )
@@ -0,0 +1,271 @@
+"""
+vectorized geometry helpers for tile footprints and mask shapes
+
+Bounding boxes are represented by the ra at their center, the half width
+in ra, and the dec range, so that comparisons handle ra wraparound
+"""
+
+import numpy as np
+
+
+def wrap_ra(ra, ra0):
+    """
+    get ra - ra0 wrapped into the range [-180, 180)
+
+    Parameters
+    ----------
+    ra: array
+        array of ra values in degrees
+    ra0: number or array
+        reference ra in degrees
+    """
+    return (np.asarray(ra) - ra0 + 180.0) % 360.0 - 180.0
+
+
+def get_circle_bbox(ra, dec, radius):
+    """
+    get bounding boxes for circles
+
+    Parameters
+    ----------
+    ra, dec: arrays
+        Centers of the circles in degrees
+    radius: array
+        Radii in degrees
+
+    Returns
+    -------
+    racen, rahalf, decmin, decmax
+    """
+    ra = np.asarray(ra, dtype='f8')
+    dec = np.asarray(dec, dtype='f8')
+    radius = np.asarray(radius, dtype='f8')
+
+    decmin = dec - radius
+    decmax = dec + radius
+
+    # the widest ra extent is at the dec furthest from the equator
+    maxabsdec = np.minimum(np.abs(dec) + radius, 90.0)
+    cosdec = np.cos(np.deg2rad(maxabsdec))
+    with np.errstate(divide='ignore'):
+        rahalf = np.where(
+            cosdec > 0,
+            radius/np.maximum(cosdec, 1.0e-12),
+            180.0,
+        )
+    rahalf = np.minimum(rahalf, 180.0)
+
+    return ra, rahalf, decmin, decmax
+
+
+def get_poly_bbox(ra, dec):
+    """
+    get bounding boxes for polygons
+
+    Parameters
+    ----------
+    ra, dec: arrays
+        Vertices in degrees, with shape (npoly, nvert)
+
+    Returns
+    -------
+    racen, rahalf, decmin, decmax
+    """
+    ra = np.atleast_2d(np.asarray(ra, dtype='f8'))
+    dec = np.atleast_2d(np.asarray(dec, dtype='f8'))
+
+    # offsets relative to the first vertex
+    dra = wrap_ra(ra, ra[:, 0:1])
+    dramin = dra.min(axis=1)
+    dramax = dra.max(axis=1)
+
+    racen = (ra[:, 0] + 0.5*(dramin + dramax)) % 360.0
+    rahalf = 0.5*(dramax - dramin)
+
+    return racen, rahalf, dec.min(axis=1), dec.max(axis=1)
+
+
+def get_corners(data):
+    """
+    get the four corners from data with fields rac1..rac4, decc1..decc4
+    as in the tile geometry and imgdata, or ra_1..ra_4, dec_1..dec_4 as
+    in the bleed trails
+
+    Returns
+    -------
+    ra, dec arrays with shape (n, 4)
+    """
+    names = data.dtype.names
+    if 'ra_1' in names:
+        rafmt, decfmt = 'ra_%d', 'dec_%d'
+    else:
+        rafmt, decfmt = 'rac%d', 'decc%d'
+
+    data = np.atleast_1d(data)
+    ra = np.stack([data[rafmt % i] for i in range(1, 5)], axis=1)
+    dec = np.stack([data[decfmt % i] for i in range(1, 5)], axis=1)
+    return ra.astype('f8'), dec.astype('f8')
+
+
+def bbox_overlaps(bbox, other):
+    """
+    check if bounding boxes overlap another box
+
+    Parameters
+    ----------
+    bbox: tuple of arrays
+        racen, rahalf, decmin, decmax as returned by get_circle_bbox
+        or get_poly_bbox
+    other: tuple
+        racen, rahalf, decmin, decmax for the box to test against
+
+    Returns
+    -------
+    bool array
+    """
+    racen, rahalf, decmin, decmax = bbox
+    oracen, orahalf, odecmin, odecmax = other
+
+    return (
+        (np.abs(wrap_ra(racen, oracen)) <= rahalf + orahalf)
+        &
+        (decmax >= odecmin)
+        &
+        (decmin <= odecmax)
+    )
+
+
+def find_covered_circles(ra, dec, radius, values=None):
+    """
+    find circles that lie entirely within another circle
+
+    Circles are binned on a grid with cells at least as large as the
+    largest radius, so only circles in neighboring cells are compared.
+    Distances use a flat sky approximation, appropriate for the sizes
+    of star masks.  When two circles are identical, only the later one
+    is marked as covered
+
+    Parameters
+    ----------
+    ra, dec: arrays
+        Centers of the circles in degrees
+    radius: array
+        Radii in degrees
+    values: array, optional
+        Bitmask values of the circles.  A circle is only considered
+        covered if its bits are a subset of the covering circle's bits
+
+    Returns
+    -------
+    bool array, True for covered circles
+    """
+    ra = np.asarray(ra, dtype='f8')
+    dec = np.asarray(dec, dtype='f8')
+    radius = np.asarray(radius, dtype='f8')
+
+    n = ra.size
+    covered = np.zeros(n, dtype=bool)
+    if n < 2:
+        return covered
+
+    if values is not None:
+        values = np.asarray(values)
+
+    # grid in approximate tangent plane coordinates; pairs missed due to
+    # the approximation are simply not removed
+    ra0 = ra[0]
+    dec0 = dec.mean()
+    x = wrap_ra(ra, ra0)*np.cos(np.deg2rad(dec0))
+    y = dec - dec0
+
+    cellsize = 1.5*radius.max()
+    if cellsize <= 0:
+        return covered
+
+    ix = np.floor((x - x.min())/cellsize).astype('i8') + 1
+    iy = np.floor((y - y.min())/cellsize).astype('i8') + 1
+    ny = iy.max() + 2
+
+    key = ix*ny + iy
+    order = np.argsort(key, kind='stable')
+    skey = key[order]
+    index = np.arange(n)
+
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            qkey = (ix + dx)*ny + (iy + dy)
+            lo = np.searchsorted(skey, qkey, side='left')
+            hi = np.searchsorted(skey, qkey, side='right')
+            counts = hi - lo
+
+            ntot = counts.sum()
+            if ntot == 0:
+                continue
+
+            # expand to all (i, j) candidate pairs
+            ii = np.repeat(index, counts)
+            starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+            jj = order[np.arange(ntot) + starts]
+
+            cosdec = np.cos(np.deg2rad(0.5*(dec[ii] + dec[jj])))
+            dist = np.hypot(
+                wrap_ra(ra[ii], ra[jj])*cosdec,
+                dec[ii] - dec[jj],
+            )
+
+            logic = (
+                (ii != jj)
+                &
+                (dist + radius[ii] <= radius[jj])
+                &
+                ((radius[ii] < radius[jj]) | (ii > jj))
+            )
+            if values is not None:
+                logic &= (values[ii] & ~values[jj]) == 0
+
+            covered[ii[logic]] = True
+
+    return covered
+
+
+def points_in_quad(ra, dec, quad_ra, quad_dec):
+    """
+    check if points are inside a convex quadrilateral, such as a tile
+
+    The edges are treated as straight lines in ra/dec, and points on an
+    edge are considered inside.  Differences in ra are wrapped so tiles
+    crossing ra=0 are handled
+
+    Parameters
+    ----------
+    ra, dec: arrays
+        Positions to check in degrees
+    quad_ra, quad_dec: arrays
+        The four corners in degrees, in order around the quadrilateral
+
+    Returns
+    -------
+    bool array
+    """
+    quad_ra = np.asarray(quad_ra, dtype='f8').ravel()
+    quad_dec = np.asarray(quad_dec, dtype='f8').ravel()
+
+    ra0 = quad_ra[0]
+    qx = wrap_ra(quad_ra, ra0)
+    px = wrap_ra(ra, ra0)
+    py = np.asarray(dec, dtype='f8')
+
+    npos = 0
+    nneg = 0
+    nvert = qx.size
+    for i in range(nvert):
+        j = (i + 1) % nvert
+        cross = (
+            (qx[j] - qx[i])*(py - quad_dec[i])
+            - (quad_dec[j] - quad_dec[i])*(px - qx[i])
+        )
+        npos = npos + (cross > 0)
+        nneg = nneg + (cross < 0)
+
+    # inside if the point is on the same side of every edge
+    return (npos == 0) | (nneg == 0)
@@ -2,9 +2,14 @@
 load the geom from fits tables
 """
 
+import logging
 import numpy as np
 import fitsio
 import healsparse as hs
+from . import profiling
+from . import geom
+
+logger = logging.getLogger(__name__)
 
 
 def read_stars(*, fname, ext='satstars'):
@@ -18,8 +23,7 @@ def read_stars(*, fname, ext='satstars'):
     ext: string, optional
         Extension to read, default 'satstars'
     """
-    with fitsio.FITS(fname) as fobj:
-        data = fobj[ext].read(lower=True)
+    data = _read_ext(fname=fname, ext=ext, name='loadmasks.read_stars')
 
     w, = np.where(
         (data['ccdnum'] != 31)
@@ -44,8 +48,7 @@ def read_bleeds(*, fname, ext='bleedtrail', skipmask=0):
         Entries that have these bits set will not be returned
     """
 
-    with fitsio.FITS(fname) as fobj:
-        data = fobj[ext].read(lower=True)
+    data = _read_ext(fname=fname, ext=ext, name='loadmasks.read_bleeds')
 
     w, = np.where(
         (data['ccdnum'] != 31)
@@ -72,8 +75,7 @@ def read_tile_geom(*, fname, ext='tilegeom'):
         Extension to read, default 'bleedtrail'
     """
 
-    with fitsio.FITS(fname) as fobj:
-        data = fobj[ext].read(lower=True)
+    data = _read_ext(fname=fname, ext=ext, name='loadmasks.read_tile_geom')
 
     return data
 
@@ -89,22 +91,17 @@ def read_imgdata(*, fname, ext='imgdata', bands=None, trim=True):
         File to read
     ext: string, optional
         Extension to read, default 'imgdata'
+    bands: sequence, optional
+        If sent, only use entries for these bands.  To get the trimmed
+        geometry for several band combinations, use read_trimmed_imgdata
     trim: bool
         If True, trim to intersection of all circles
     """
 
-    with fitsio.FITS(fname) as fobj:
-        data = fobj[ext].read(lower=True)
+    data = _read_ext(fname=fname, ext=ext, name='loadmasks.read_imgdata')
 
     if bands is not None:
-        dbands = np.char.rstrip(data['band'])
-        for i in range(len(bands)):
-            tlogic = dbands == bands[i]
-            if i == 0:
-                logic = tlogic
-            else:
-                logic = logic | tlogic
-        w, = np.where(logic)
+        w, = np.where(_get_band_logic(data, bands))
         if w.size == 0:
             raise ValueError('none matched bands %s' % str(bands))
 
@@ -117,16 +114,96 @@ def read_imgdata(*, fname, ext='imgdata', bands=None, trim=True):
         mindec = max(data['decc2'].max(), data['decc3'].max())
         maxdec = min(data['decc1'].min(), data['decc4'].min())
 
-        data = data[0:0+1]
-        data['rac1'] = minra
-        data['rac2'] = minra
-        data['rac3'] = maxra
-        data['rac4'] = maxra
+        data = _make_trimmed(data[0:0+1], minra, maxra, mindec, maxdec)
+
+    return data
+
+
+def read_trimmed_imgdata(*, fname, band_sets, ext='imgdata'):
+    """
+    read the imgdata extension once and get the trimmed geometry for
+    each of a set of band combinations
+
+    The corner extremes are reduced once per band, and the extremes for
+    each band combination are then combined from those
+
+    Parameters
+    ----------
+    fname: string
+        File to read
+    band_sets: sequence
+        Sequence of band combinations, e.g. ['griz', 'riz', ['r', 'i']]
+    ext: string, optional
+        Extension to read, default 'imgdata'
+
+    Returns
+    -------
+    list of trimmed geometry, one for each entry in band_sets, each as
+    would be returned by read_imgdata with trim=True
+    """
+
+    data = _read_ext(fname=fname, ext=ext, name='loadmasks.read_imgdata')
+
+    ubands, band_index = np.unique(_get_bands(data), return_inverse=True)
+    band_index = band_index.ravel()
+
+    # extremes of the corners for each band
+    nband = ubands.size
+    band_minra = np.full(nband, -np.inf)
+    band_maxra = np.full(nband, np.inf)
+    band_mindec = np.full(nband, -np.inf)
+    band_maxdec = np.full(nband, np.inf)
+
+    np.maximum.at(
+        band_minra, band_index, np.maximum(data['rac1'], data['rac2']),
+    )
+    np.minimum.at(
+        band_maxra, band_index, np.minimum(data['rac3'], data['rac4']),
+    )
+    np.maximum.at(
+        band_mindec, band_index, np.maximum(data['decc2'], data['decc3']),
+    )
+    np.minimum.at(
+        band_maxdec, band_index, np.minimum(data['decc1'], data['decc4']),
+    )
+
+    output = []
+    for bands in band_sets:
+        wband, = np.where(np.isin(ubands, list(bands)))
+        if wband.size == 0:
+            raise ValueError('none matched bands %s' % str(bands))
+
+        # first row from one of the bands, as in read_imgdata
+        irow = np.argmax(np.isin(band_index, wband))
+
+        output.append(
+            _make_trimmed(
+                data[irow:irow+1],
+                band_minra[wband].max(),
+                band_maxra[wband].min(),
+                band_mindec[wband].max(),
+                band_maxdec[wband].min(),
+            )
+        )
+
+    return output
+
+
+def _make_trimmed(template, minra, maxra, mindec, maxdec):
+    """
+    make the trimmed geometry, copying the other fields from the
+    template row
+    """
+    data = template.copy()
+    data['rac1'] = minra
+    data['rac2'] = minra
+    data['rac3'] = maxra
+    data['rac4'] = maxra
 
-        data['decc1'] = maxdec
-        data['decc2'] = mindec
-        data['decc3'] = mindec
-        data['decc4'] = maxdec
+    data['decc1'] = maxdec
+    data['decc2'] = mindec
+    data['decc3'] = mindec
+    data['decc4'] = maxdec
 
     return data
 
@@ -159,7 +236,9 @@ def get_trimmed_tile_geom(indata, trim_pixels=100):
     return data
 
 
-def load_circles(*, data, values, bands=None, expand=1.0):
+@profiling.timed('loadmasks.load_circles')
+def load_circles(*, data, values, bands=None, expand=1.0,
+                 bounds=None, remove_covered=False):
     """
     load a set of circle objects from the input data
 
@@ -169,6 +248,13 @@ def load_circles(*, data, values, bands=None, expand=1.0):
         Must have ra, dec, radius, badpix fields
     expand: number, optional
         Factor by which to expand star masks, default 1
+    bounds: array with fields, optional
+        Tile geometry as returned by read_tile_geom, read_imgdata or
+        get_trimmed_tile_geom.  Circles that do not overlap the bounding
+        box of the tile are dropped
+    remove_covered: bool, optional
+        If True, drop circles that lie entirely within another circle
+        whose value has all the same bits set
     """
 
     has_bands = 'band' in data.dtype.names
@@ -177,31 +263,49 @@ def load_circles(*, data, values, bands=None, expand=1.0):
 
     values = _extract_values(values, data.size)
 
-    circles = []
-    for i in range(data.size):
+    radius = data['radius']/3600.0
+    radius *= expand
 
-        idata = data[i]
+    keep = np.ones(data.size, dtype=bool)
+    if bands is not None:
+        keep &= _get_band_logic(data, bands)
 
-        if bands is not None:
-            band = idata['band'].strip()
-            if band not in bands:
-                continue
+    if bounds is not None:
+        bbox = geom.get_circle_bbox(data['ra'], data['dec'], radius)
+        keep &= geom.bbox_overlaps(bbox, _get_bounds_bbox(bounds))
 
-        radius = idata['radius']/3600.0
-        radius *= expand
+    w, = np.where(keep)
+
+    if remove_covered and w.size > 1:
+        covered = geom.find_covered_circles(
+            data['ra'][w],
+            data['dec'][w],
+            radius[w],
+            values=np.asarray(values)[w],
+        )
+        w = w[~covered]
+
+    profiling.add_count('loadmasks.ncircles_dropped', data.size - w.size)
+
+    circles = []
+    for i in w:
+
+        idata = data[i]
 
         circle = hs.Circle(
             ra=idata['ra'],
             dec=idata['dec'],
-            radius=radius,
+            radius=radius[i],
             value=values[i],
         )
         circles.append(circle)
 
+    profiling.add_count('loadmasks.ncircles', len(circles))
     return circles
 
 
-def load_polygons(*, data, values, bands=None):
+@profiling.timed('loadmasks.load_polygons')
+def load_polygons(*, data, values, bands=None, bounds=None):
     """
     load a set of polygons (rectangles) from the input
     data.  EDGEBLEED is skipped for 'u' and 'Y' bands
@@ -215,6 +319,10 @@ def load_polygons(*, data, values, bands=None):
         ra_3, dec_3
         ra_4, dec_4
         badpix
+    bounds: array with fields, optional
+        Tile geometry as returned by read_tile_geom, read_imgdata or
+        get_trimmed_tile_geom.  Polygons that do not overlap the
+        bounding box of the tile are dropped
     """
 
     values = _extract_values(values, data.size)
@@ -226,65 +334,86 @@ def load_polygons(*, data, values, bands=None):
 
     EDGEBLEED = 128
 
-    polygons = []
-    for i in range(data.size):
+    keep = np.ones(data.size, dtype=bool)
+    if bands is not None:
+        keep &= _get_band_logic(data, bands)
+
+    nskipped = 0
+    if has_bands and has_badpix:
+        edge = (
+            keep
+            &
+            _get_band_logic(data, ['u', 'Y'])
+            &
+            (data['badpix'] == EDGEBLEED)
+        )
+        nskipped = edge.sum()
+        keep &= ~edge
 
-        idata = data[i]
+    ra, dec = geom.get_corners(data)
 
-        if has_bands and bands is not None:
-            band = idata['band'].strip()
-            if band not in bands:
-                continue
+    if bounds is not None:
+        bbox = geom.get_poly_bbox(ra, dec)
+        keep &= geom.bbox_overlaps(bbox, _get_bounds_bbox(bounds))
 
-        if (has_bands and
-                has_badpix and
-                band in ['u', 'Y'] and
-                idata['badpix'] == EDGEBLEED):
+    w, = np.where(keep)
 
-            print('skipping %s EDGEBLEED' % band)
-            continue
+    profiling.add_count('loadmasks.npolygons_dropped', data.size - w.size)
 
-        ra, dec = _extract_vert(idata)
+    polygons = []
+    for i in w:
 
         polygon = hs.Polygon(
-            ra=ra,
-            dec=dec,
+            ra=ra[i],
+            dec=dec[i],
             value=values[i],
         )
         polygons.append(polygon)
 
+    if nskipped > 0:
+        logger.debug('skipped %d u/Y EDGEBLEED entries', nskipped)
+
+    profiling.add_count('loadmasks.npolygons', len(polygons))
     return polygons
 
 
-def _extract_vert(idata):
-    if 'ra_1' in idata.dtype.names:
-        ra = [
-            idata['ra_1'],
-            idata['ra_2'],
-            idata['ra_3'],
-            idata['ra_4'],
-        ]
-        dec = [
-            idata['dec_1'],
-            idata['dec_2'],
-            idata['dec_3'],
-            idata['dec_4'],
-        ]
-    else:
-        ra = [
-            idata['rac1'],
-            idata['rac2'],
-            idata['rac3'],
-            idata['rac4'],
-        ]
-        dec = [
-            idata['decc1'],
-            idata['decc2'],
-            idata['decc3'],
-            idata['decc4'],
-        ]
-
-    return ra, dec
+def _get_bands(data):
+    """
+    get the band names with padding stripped
+    """
+    return np.char.strip(data['band'])
+
+
+def _get_band_logic(data, bands):
+    """
+    get logic for entries with band in the input bands
+    """
+    return np.isin(_get_bands(data), list(bands))
+
+
+def _get_bounds_bbox(bounds):
+    """
+    get the bounding box for a tile geometry
+    """
+    ra, dec = geom.get_corners(bounds)
+    racen, rahalf, decmin, decmax = geom.get_poly_bbox(
+        ra.reshape(1, -1),
+        dec.reshape(1, -1),
+    )
+    return racen[0], rahalf[0], decmin[0], decmax[0]
+
+
+def _read_ext(*, fname, ext, name):
+    """
+    read the extension, recording the time, rows and bytes read
+    """
+    with profiling.timer(name):
+        with fitsio.FITS(fname) as fobj:
+            data = fobj[ext].read(lower=True)
+
+    profiling.add_count('loadmasks.rows_read', data.size)
+    profiling.add_count('loadmasks.bytes_read', data.nbytes)
+    return data
 
 
 def _extract_values(values, n):
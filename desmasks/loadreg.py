@@ -3,12 +3,15 @@ load the geom from ds9 region files converted to sky coords
 """
 
 import os
+import logging
 import numpy as np
 import healsparse as hs
 
 STAR = 32
 TRAIL = 64
 
+logger = logging.getLogger(__name__)
+
 
 def load_regions(fname, doplot=False, verbose=False, **kw):
     """
@@ -24,7 +27,7 @@ def load_regions(fname, doplot=False, verbose=False, **kw):
         If set, make a plot
     **kw keywords for the plotting
     """
-    print('reading geom from:', fname)
+    logger.debug('reading geom from: %s', fname)
     with open(fname) as fobj:
 
         circles = []
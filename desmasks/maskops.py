@@ -0,0 +1,215 @@
+"""
+set and bit operations on mask maps
+
+The inputs can be TileMask objects or HealSparseMaps, e.g. from realizing
+the geometry of load_regions.  Operations work on the valid pixels of the
+maps, so memory use is proportional to the coverage rather than the full
+sky.  All maps must have the same nside
+"""
+
+import functools
+import numpy as np
+
+
+def or_masks(*masks):
+    """
+    or together the mask flags, over the union of the coverage
+
+    Parameters
+    ----------
+    *masks: TileMask or HealSparseMap
+        The masks to combine
+
+    Returns
+    -------
+    HealSparseMap
+    """
+    smaps = [_get_mask_map(mask) for mask in masks]
+    pixels = _union_pixels(smaps)
+
+    values = _get_values(smaps, pixels, np.bitwise_or)
+    return _make_map(smaps[0], pixels, values)
+
+
+def and_masks(*masks):
+    """
+    and together the mask flags, over the intersection of the coverage.
+    Pixels where the result is zero are not set
+
+    Parameters
+    ----------
+    *masks: TileMask or HealSparseMap
+        The masks to combine
+
+    Returns
+    -------
+    HealSparseMap
+    """
+    smaps = [_get_mask_map(mask) for mask in masks]
+    pixels = _intersect_pixels(smaps)
+
+    values = _get_values(smaps, pixels, np.bitwise_and)
+
+    w, = np.where(values != 0)
+    return _make_map(smaps[0], pixels[w], values[w])
+
+
+def intersect_bounds(*masks):
+    """
+    get the intersection of the bounds of the input tile masks
+
+    Parameters
+    ----------
+    *masks: TileMask
+        The masks to combine
+
+    Returns
+    -------
+    HealSparseMap with value 1 inside all bounds
+    """
+    smaps = []
+    for mask in masks:
+        if mask.bounds_map is None:
+            raise ValueError('mask has no bounds map')
+        smaps.append(mask.bounds_map)
+
+    _check_nside(smaps)
+
+    pixels = None
+    for smap in smaps:
+        vpix = smap.valid_pixels
+        vpix = vpix[smap.get_values_pix(vpix) != 0]
+
+        if pixels is None:
+            pixels = vpix
+        else:
+            pixels = np.intersect1d(pixels, vpix, assume_unique=True)
+
+    values = np.ones(pixels.size, dtype='i2')
+    return _make_map(smaps[0], pixels, values)
+
+
+def diff_masks(mask1, mask2):
+    """
+    compare the flags of two masks
+
+    Parameters
+    ----------
+    mask1, mask2: TileMask or HealSparseMap
+        The masks to compare, e.g. with and without UltraVISTA
+
+    Returns
+    -------
+    dict with entries
+        nside, pixel_area: the nside and pixel area in square degrees
+        npix_changed, area_changed: number and area of pixels with
+            different flags
+        bits: dict keyed by bit value for each bit that changed, with
+            npix_added, npix_removed, area_added and area_removed for
+            pixels where the bit is set only in mask2 (added) or only in
+            mask1 (removed)
+    """
+    import healpy as hp
+
+    smaps = [_get_mask_map(mask1), _get_mask_map(mask2)]
+    pixels = _union_pixels(smaps)
+
+    v1 = smaps[0].get_values_pix(pixels)
+    v2 = smaps[1].get_values_pix(pixels)
+
+    nside = smaps[0].nside_sparse
+    pixel_area = float(hp.nside2pixarea(nside, degrees=True))
+
+    w, = np.where(v1 != v2)
+    v1 = v1[w]
+    v2 = v2[w]
+
+    # unsigned view so the top bit of signed flags is handled like the
+    # others
+    dtype = np.result_type(v1.dtype, v2.dtype)
+    udtype = np.dtype('u%d' % dtype.itemsize)
+    v1 = v1.astype(dtype, copy=False).view(udtype)
+    v2 = v2.astype(dtype, copy=False).view(udtype)
+
+    bits = {}
+    for ibit in range(8*udtype.itemsize):
+        bit = udtype.type(1) << udtype.type(ibit)
+
+        set1 = (v1 & bit) != 0
+        set2 = (v2 & bit) != 0
+
+        npix_added = int((set2 & ~set1).sum())
+        npix_removed = int((set1 & ~set2).sum())
+        if npix_added + npix_removed > 0:
+            bits[int(bit)] = {
+                'npix_added': npix_added,
+                'npix_removed': npix_removed,
+                'area_added': npix_added*pixel_area,
+                'area_removed': npix_removed*pixel_area,
+            }
+
+    return {
+        'nside': nside,
+        'pixel_area': pixel_area,
+        'npix_changed': w.size,
+        'area_changed': w.size*pixel_area,
+        'bits': bits,
+    }
+
+
+def _get_mask_map(mask):
+    """
+    get the mask flag map from a TileMask, or pass through a map
+    """
+    if hasattr(mask, 'mask_map'):
+        return mask.mask_map
+    else:
+        return mask
+
+
+def _check_nside(smaps):
+    nsides = set(smap.nside_sparse for smap in smaps)
+    if len(nsides) > 1:
+        raise ValueError('maps must have the same nside, '
+                         'got %s' % sorted(nsides))
+
+
+def _union_pixels(smaps):
+    _check_nside(smaps)
+    return np.unique(
+        np.concatenate([smap.valid_pixels for smap in smaps])
+    )
+
+
+def _intersect_pixels(smaps):
+    _check_nside(smaps)
+    return functools.reduce(
+        lambda p1, p2: np.intersect1d(p1, p2, assume_unique=True),
+        [smap.valid_pixels for smap in smaps],
+    )
+
+
+def _get_values(smaps, pixels, ufunc):
+    values = smaps[0].get_values_pix(pixels)
+    for smap in smaps[1:]:
+        values = ufunc(values, smap.get_values_pix(pixels))
+
+    return values
+
+
+def _make_map(template, pixels, values):
+    """
+    make a new map with the same resolution as the template
+    """
+    import healsparse as hs
+
+    smap = hs.HealSparseMap.make_empty(
+        nside_coverage=template.nside_coverage,
+        nside_sparse=template.nside_sparse,
+        dtype=values.dtype,
+        sentinel=0,
+    )
+    if pixels.size > 0:
+        smap.update_values_pix(pixels, values)
+
+    return smap
@@ -1,42 +1,237 @@
 from __future__ import print_function
+import os
+import logging
+import collections
+import collections.abc
+import itertools
+import numpy as np
 from . import files
+from . import profiling
+from . import geom
 
+logger = logging.getLogger(__name__)
 
-def load_tile_mask(tilename=None, with_uvista=False):
+
+def load_tile_mask(tilename=None, with_uvista=False, tile_geom=None):
+    """
+    load the mask for the specified tile
+
+    Parameters
+    ----------
+    tilename: string
+        Either the basic tilename such as SN-C3_C10
+        or with reqnum/attnum SN-C3_C10_r3688p01
+    with_uvista: bool, optional
+        If True, load the mask including UltraVISTA
+    tile_geom: array with fields, optional
+        Tile geometry as returned by read_tile_geom, read_imgdata or
+        get_trimmed_tile_geom.  If sent, the bounds are checked
+        analytically and the bounds file is not read
+    """
 
     mask_fname = files.get_mask_file(tilename, with_uvista=with_uvista)
-    bounds_fname = files.get_bounds_file(tilename)
+    logger.debug('loading mask from: %s', mask_fname)
+
+    if tile_geom is None:
+        bounds_fname = files.get_bounds_file(tilename)
+        logger.debug('loading bounds from: %s', bounds_fname)
+    else:
+        bounds_fname = None
+
+    return TileMask(
+        mask_fname=mask_fname,
+        bounds_fname=bounds_fname,
+        tile_geom=tile_geom,
+    )
+
+
+def iter_tile_masks(tilenames, with_uvista=False, nprefetch=2,
+                    tile_geoms=None):
+    """
+    iterate over tile masks, loading the upcoming tiles in background
+    threads so their I/O overlaps with work on the current tile
+
+    At most nprefetch tiles are being loaded at any time, in addition
+    to the tile currently held by the caller
+
+    Parameters
+    ----------
+    tilenames: sequence of strings
+        The tilenames, either basic or with reqnum/attnum
+    with_uvista: bool, optional
+        If True, load masks including UltraVISTA
+    nprefetch: int, optional
+        Number of tiles to load ahead, default 2
+    tile_geoms: mapping or sequence, optional
+        Tile geometry for each tile, either a mapping keyed by tilename
+        or a sequence parallel to tilenames.  See load_tile_mask
+
+    Yields
+    ------
+    tilename, TileMask
+
+    Examples
+    --------
+    for tilename, tmask in iter_tile_masks(tilenames, nprefetch=4):
+        flags = tmask.get_mask_flags(ra, dec)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if nprefetch < 1:
+        raise ValueError('nprefetch must be >= 1, got %d' % nprefetch)
 
-    print('loading mask from:', mask_fname)
-    print('loading bounds from:', bounds_fname)
-    return TileMask(mask_fname=mask_fname, bounds_fname=bounds_fname)
+    if tile_geoms is None:
+        items = ((tilename, None) for tilename in tilenames)
+    elif isinstance(tile_geoms, collections.abc.Mapping):
+        items = (
+            (tilename, tile_geoms.get(tilename)) for tilename in tilenames
+        )
+    else:
+        items = _zip_strict(tilenames, tile_geoms)
+
+    pending = collections.deque()
+
+    def submit_next():
+        for tilename, tile_geom in items:
+            future = executor.submit(
+                load_tile_mask,
+                tilename=tilename,
+                with_uvista=with_uvista,
+                tile_geom=tile_geom,
+            )
+            pending.append((tilename, future))
+            break
+
+    executor = ThreadPoolExecutor(max_workers=nprefetch)
+    try:
+        for i in range(nprefetch):
+            submit_next()
+
+        while pending:
+            tilename, future = pending.popleft()
+            tmask = future.result()
+
+            # keep the window full while the caller works on this tile
+            submit_next()
+
+            yield tilename, tmask
+
+            # drop our reference so memory is bounded by the window
+            del tmask
+    finally:
+        for tilename, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 class TileMask(object):
     """
     combined bad region mask and tile boundary
+
+    Parameters
+    ----------
+    mask_fname: string
+        The healsparse mask file
+    bounds_fname: string, optional
+        The healsparse bounds file
+    tile_geom: array with fields, optional
+        Tile geometry as returned by read_tile_geom, read_imgdata or
+        get_trimmed_tile_geom.  If sent, the bounds are checked with a
+        point-in-quadrilateral test and bounds_fname is not used.  Note
+        the edges are then straight lines in ra/dec rather than great
+        circles
     """
-    def __init__(self, mask_fname, bounds_fname):
+    def __init__(self, mask_fname, bounds_fname=None, tile_geom=None):
+        if bounds_fname is None and tile_geom is None:
+            raise ValueError('send bounds_fname= or tile_geom=')
+
+        if tile_geom is not None and np.atleast_1d(tile_geom).size != 1:
+            raise ValueError(
+                'tile_geom must have a single row, got %d; use '
+                'read_imgdata with trim=True' % np.atleast_1d(tile_geom).size
+            )
+
         self._mask_fname = mask_fname
         self._bounds_fname = bounds_fname
+        self._tile_geom = tile_geom
         self._load_masks()
 
     def _load_masks(self):
-        import healsparse as hs
-        self._mask_map = hs.HealSparseMap.read(self._mask_fname)
-        self._bounds_map = hs.HealSparseMap.read(self._bounds_fname)
+        self._mask_map = _read_map(self._mask_fname, 'masks.read_mask')
+
+        # degraded maps for coarse pixel queries
+        self._degraded = {'mask': {}, 'bounds': {}}
+
+        if self._tile_geom is not None:
+            self._bounds_map = None
+            ra, dec = geom.get_corners(self._tile_geom)
+            self._bounds_ra = ra[0]
+            self._bounds_dec = dec[0]
+        else:
+            self._bounds_map = _read_map(
+                self._bounds_fname, 'masks.read_bounds',
+            )
+
+    @property
+    def mask_map(self):
+        """
+        get the healsparse map of mask flags
+        """
+        return self._mask_map
+
+    @property
+    def bounds_map(self):
+        """
+        get the healsparse map of the tile bounds, None if the bounds
+        are analytic
+        """
+        return self._bounds_map
+
+    @property
+    def nside(self):
+        """
+        get the nside of the mask map
+        """
+        return self._mask_map.nside_sparse
+
+    def is_in_bounds(self, ra, dec):
+        """
+        check if the input positions are within the tile bounds
+        """
+        if self._bounds_map is None:
+            return geom.points_in_quad(
+                ra, dec, self._bounds_ra, self._bounds_dec,
+            )
+        else:
+            return self._bounds_map.get_values_pos(ra, dec) != 0
 
     def is_masked(self, ra, dec):
         """
         check if the input positions are masked
+
+        The mask map is only checked for positions within the bounds
         """
 
-        mask_values = self._mask_map.get_values_pos(ra, dec)
-        bounds_values = self._bounds_map.get_values_pos(ra, dec)
+        is_scalar = np.ndim(ra) == 0
+        ra, dec = np.atleast_1d(ra, dec)
 
-        return (
-            (mask_values > 0) | (bounds_values == 0)
-        )
+        with profiling.timer('masks.is_masked'):
+            in_bounds = self.is_in_bounds(ra, dec)
+            is_masked = ~in_bounds
+
+            # boolean indexing keeps the shape of multi-dimensional input
+            if in_bounds.any():
+                mask_values = self._mask_map.get_values_pos(
+                    ra[in_bounds], dec[in_bounds],
+                )
+                is_masked[in_bounds] = mask_values > 0
+
+        profiling.add_count('masks.rows_queried', ra.size)
+
+        if is_scalar:
+            is_masked = is_masked[0]
+
+        return is_masked
 
     def is_unmasked(self, ra, dec):
         """
@@ -50,4 +245,245 @@ class TileMask(object):
         """
         get mask values (not from bounds)
         """
-        return self._mask_map.get_values_pos(ra, dec)
+        with profiling.timer('masks.get_mask_flags'):
+            mask_values = self._mask_map.get_values_pos(ra, dec)
+
+        profiling.add_count('masks.rows_queried', mask_values.size)
+        return mask_values
+
+    def is_masked_pix(self, pixels, nside=None):
+        """
+        check if the input nest pixels are masked
+
+        Pixels coarser than the map are considered masked if any of their
+        subpixels is masked or outside the bounds
+
+        Parameters
+        ----------
+        pixels: array
+            Nest pixel indices, e.g. from get_pixels
+        nside: int, optional
+            nside of the pixels, default the nside of the mask map
+        """
+        with profiling.timer('masks.is_masked_pix'):
+            mask_values = _get_values_pix(
+                self._mask_map, pixels, nside, np.bitwise_or,
+                cache=self._degraded['mask'],
+            )
+            in_bounds = self._is_in_bounds_pix(pixels, nside)
+
+        profiling.add_count('masks.rows_queried', mask_values.size)
+
+        return (
+            (mask_values > 0) | ~in_bounds
+        )
+
+    def _is_in_bounds_pix(self, pixels, nside):
+        """
+        check if pixels are within the bounds.  For analytic bounds,
+        pixels coarser than the map are in bounds if all their corners
+        are, otherwise the pixel centers are used
+        """
+        if self._bounds_map is not None:
+            bounds_values = _get_values_pix(
+                self._bounds_map, pixels, nside, np.minimum,
+                cache=self._degraded['bounds'],
+            )
+            return bounds_values != 0
+
+        import healpy as hp
+
+        if nside is None:
+            nside = self.nside
+        else:
+            nside = int(nside)
+
+        if nside >= self.nside:
+            ra, dec = hp.pix2ang(nside, pixels, nest=True, lonlat=True)
+            return geom.points_in_quad(
+                ra, dec, self._bounds_ra, self._bounds_dec,
+            )
+
+        # shape (..., 3, 4) for the four corners
+        vec = hp.boundaries(nside, pixels, step=1, nest=True)
+        vec = np.moveaxis(vec, -2, -1)
+        ra, dec = hp.vec2ang(vec.reshape(-1, 3), lonlat=True)
+        in_bounds = geom.points_in_quad(
+            ra, dec, self._bounds_ra, self._bounds_dec,
+        )
+        return in_bounds.reshape(vec.shape[:-1]).all(axis=-1)
+
+    def is_unmasked_pix(self, pixels, nside=None):
+        """
+        check if the input nest pixels are unmasked
+        """
+        return ~self.is_masked_pix(pixels, nside=nside)
+
+    def get_mask_flags_pix(self, pixels, nside=None):
+        """
+        get mask values (not from bounds) for the input nest pixels
+
+        For pixels coarser than the map, the flags of all subpixels are
+        or'ed together
+
+        Parameters
+        ----------
+        pixels: array
+            Nest pixel indices, e.g. from get_pixels
+        nside: int, optional
+            nside of the pixels, default the nside of the mask map
+        """
+        with profiling.timer('masks.get_mask_flags_pix'):
+            mask_values = _get_values_pix(
+                self._mask_map, pixels, nside, np.bitwise_or,
+                cache=self._degraded['mask'],
+            )
+
+        profiling.add_count('masks.rows_queried', mask_values.size)
+        return mask_values
+
+
+def _zip_strict(tilenames, tile_geoms):
+    """
+    zip tilenames with their geometry, raising if the lengths differ
+    """
+    sentinel = object()
+    for tilename, tile_geom in itertools.zip_longest(
+        tilenames, tile_geoms, fillvalue=sentinel,
+    ):
+        if tilename is sentinel or tile_geom is sentinel:
+            raise ValueError('tile_geoms must be the same length '
+                             'as tilenames')
+
+        yield tilename, tile_geom
+
+
+def get_pixels(ra, dec, nside=2**17):
+    """
+    get nest pixel indices for the input positions, for reuse with the
+    is_masked_pix and get_mask_flags_pix methods of any number of masks
+
+    Parameters
+    ----------
+    ra: array
+        array of ra values in degrees
+    dec: array
+        array of dec values in degrees
+    nside: int, optional
+        nside for the pixels, default 2**17.  Use the nside of the
+        masks to avoid degrading or upgrading on lookup
+
+    Examples
+    --------
+    pixels = get_pixels(ra, dec, nside=tmask.nside)
+    flags = tmask.get_mask_flags_pix(pixels)
+    flags |= other_tmask.get_mask_flags_pix(pixels)
+    """
+    import healpy as hp
+
+    with profiling.timer('masks.get_pixels'):
+        pixels = hp.ang2pix(nside, ra, dec, nest=True, lonlat=True)
+
+    return pixels
+
+
+def _get_values_pix(smap, pixels, nside, ufunc, cache=None):
+    """
+    get map values for nest pixels at the given nside
+
+    Pixels finer than the map are degraded to the map nside.  For pixels
+    coarser than the map, the values of the valid map pixels are
+    degraded to the query nside and combined with ufunc.reduce; pixels
+    not fully covered by valid pixels also include the sentinel.  This
+    uses memory proportional to the coverage of the map, independent of
+    the number of subpixels
+
+    Parameters
+    ----------
+    cache: dict, optional
+        If sent, the degraded values are stored here keyed by nside and
+        ufunc, for reuse in later calls
+    """
+    map_nside = smap.nside_sparse
+    if nside is None:
+        return smap.get_values_pix(pixels)
+
+    # nside is often a numpy integer from a header or array
+    nside = int(nside)
+    if nside == map_nside:
+        return smap.get_values_pix(pixels)
+
+    if nside < 1 or (nside & (nside - 1)) != 0:
+        raise ValueError('nside must be a power of 2, got %d' % nside)
+
+    pixels = np.asarray(pixels, dtype='i8')
+
+    if nside > map_nside:
+        shift = 2*(nside.bit_length() - map_nside.bit_length())
+        return smap.get_values_pix(pixels >> shift)
+
+    key = (nside, ufunc.__name__)
+    if cache is not None and key in cache:
+        dpixels, dvalues = cache[key]
+    else:
+        dpixels, dvalues = _degrade_values(smap, nside, ufunc)
+        if cache is not None:
+            cache[key] = (dpixels, dvalues)
+
+    values = np.full(pixels.shape, smap.sentinel, dtype=smap.dtype)
+    if dpixels.size > 0:
+        index = np.searchsorted(dpixels, pixels)
+        index = np.clip(index, 0, dpixels.size - 1)
+        found = dpixels[index] == pixels
+        values[found] = dvalues[index[found]]
+
+    return values
+
+
+def _degrade_values(smap, nside, ufunc):
+    """
+    combine the values of the valid pixels of the map within each pixel
+    at the lower nside
+
+    Returns
+    -------
+    sorted unique pixels at nside, combined values
+    """
+    shift = 2*(smap.nside_sparse.bit_length() - nside.bit_length())
+
+    vpixels = smap.valid_pixels
+    vvalues = smap.get_values_pix(vpixels)
+
+    dpixels = vpixels >> shift
+    order = np.argsort(dpixels, kind='stable')
+    dpixels = dpixels[order]
+    vvalues = vvalues[order]
+
+    dpixels, starts, counts = np.unique(
+        dpixels, return_index=True, return_counts=True,
+    )
+    if dpixels.size == 0:
+        return dpixels, vvalues[:0]
+
+    dvalues = ufunc.reduceat(vvalues, starts)
+
+    # some subpixels are unset and hold the sentinel
+    partial = counts < (1 << shift)
+    dvalues[partial] = ufunc(dvalues[partial], smap.sentinel)
+
+    return dpixels, dvalues
+
+
+def _read_map(fname, name):
+    """
+    read a healsparse map, recording the time and bytes read
+    """
+    import healsparse as hs
+
+    with profiling.timer(name):
+        smap = hs.HealSparseMap.read(fname)
+
+    if profiling.is_enabled():
+        profiling.add_count('masks.bytes_read', os.path.getsize(fname))
+
+    return smap
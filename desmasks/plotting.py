@@ -2,11 +2,14 @@
 load the geom from fits tables
 """
 
+import logging
 import numpy as np
 import healsparse as hs
 import healpy as hp
 import colorsys
 
+logger = logging.getLogger(__name__)
+
 
 def get_colors():
     uvals = np.array(
@@ -53,7 +56,7 @@ def plot_by_val(smap, ra, dec, use_rainbow=False, show=False, **kw):
 
     vals = smap.get_values_pos(ra, dec)
     uvals = np.unique(vals)
-    print('uvals: %s' % repr(uvals))
+    logger.debug('uvals: %r', uvals)
     if use_rainbow:
         if uvals.size == 1:
             colors = ['orange']
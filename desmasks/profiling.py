@@ -0,0 +1,248 @@
+"""
+optional timing and counting instrumentation for desmasks operations
+
+Instrumentation is disabled by default, in which case the timers and
+counters reduce to a flag check.  Enable it with enable(), run the code
+of interest, and inspect the results with get_report(), print_report()
+or write_json()
+
+    import desmasks
+    desmasks.profiling.enable()
+    tmask = desmasks.load_tile_mask(tilename='DES0000+0209')
+    flags = tmask.get_mask_flags(ra, dec)
+    desmasks.profiling.print_report()
+"""
+
+import time
+import json
+import functools
+import threading
+
+_enabled = False
+_timers = {}
+_counters = {}
+
+# updates may come from loader and server threads
+_lock = threading.Lock()
+
+
+def enable():
+    """
+    turn on timing and counting
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    turn off timing and counting; accumulated results are kept
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """
+    returns True if instrumentation is turned on
+    """
+    return _enabled
+
+
+def reset():
+    """
+    clear all accumulated timers and counters
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def add_time(name, seconds):
+    """
+    add time to the named timer
+
+    Parameters
+    ----------
+    name: string
+        Name of the timer
+    seconds: float
+        Elapsed time to add
+    """
+    if not _enabled:
+        return
+
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def add_count(name, num=1):
+    """
+    add to the named counter, e.g. rows processed or bytes read
+
+    Parameters
+    ----------
+    name: string
+        Name of the counter
+    num: int, optional
+        Amount to add, default 1
+    """
+    if not _enabled:
+        return
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + int(num)
+
+
+class _NullTimer(object):
+    """
+    no-op context manager returned when instrumentation is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    """
+    context manager that adds the elapsed time to the named timer
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __enter__(self):
+        self._tm0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_time(self._name, time.perf_counter() - self._tm0)
+        return False
+
+
+def timer(name):
+    """
+    get a context manager that times the enclosed block
+
+    Parameters
+    ----------
+    name: string
+        Name of the timer
+
+    Examples
+    --------
+    with profiling.timer('masks.read'):
+        smap = hs.HealSparseMap.read(fname)
+    """
+    if not _enabled:
+        return _NULL_TIMER
+
+    return _Timer(name)
+
+
+def timed(name=None):
+    """
+    decorator that times each call of the wrapped function
+
+    Parameters
+    ----------
+    name: string, optional
+        Name of the timer, default is module.qualname of the function
+    """
+    def decorator(func):
+        tname = name
+        if tname is None:
+            tname = '%s.%s' % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            if not _enabled:
+                return func(*args, **kw)
+
+            tm0 = time.perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                add_time(tname, time.perf_counter() - tm0)
+
+        return wrapper
+
+    return decorator
+
+
+def get_report():
+    """
+    get a summary of the timers and counters
+
+    Returns
+    -------
+    dict with entries 'timers' and 'counters'.  Each timer has
+    entries ncalls, total and mean, with times in seconds
+    """
+    with _lock:
+        timer_items = [(name, list(entry)) for name, entry in _timers.items()]
+        counter_items = list(_counters.items())
+
+    timers = {}
+    for name, (ncalls, total) in sorted(timer_items):
+        timers[name] = {
+            'ncalls': ncalls,
+            'total': total,
+            'mean': total/ncalls,
+        }
+
+    counters = {}
+    for name, value in sorted(counter_items):
+        counters[name] = value
+
+    return {'timers': timers, 'counters': counters}
+
+
+def print_report(stream=None):
+    """
+    print a summary of the timers and counters
+
+    Parameters
+    ----------
+    stream: file object, optional
+        Where to write the report, default stdout
+    """
+    report = get_report()
+
+    lines = ['%-40s %10s %12s %12s' % ('timer', 'ncalls', 'total', 'mean')]
+    for name, entry in report['timers'].items():
+        lines.append(
+            '%-40s %10d %12.6f %12.6f' % (
+                name, entry['ncalls'], entry['total'], entry['mean'],
+            )
+        )
+
+    if report['counters']:
+        lines.append('')
+        lines.append('%-40s %10s' % ('counter', 'value'))
+        for name, value in report['counters'].items():
+            lines.append('%-40s %10d' % (name, value))
+
+    print('\n'.join(lines), file=stream)
+
+
+def write_json(fname):
+    """
+    write the report to a JSON file
+
+    Parameters
+    ----------
+    fname: string
+        File to write
+    """
+    with open(fname, 'w') as fobj:
+        json.dump(get_report(), fobj, indent=2)
@@ -0,0 +1,680 @@
+"""
+local mask query service
+
+A MaskServer keeps a cache of loaded TileMask and ObjMask objects and
+answers batched queries over a unix socket or a localhost TCP port.
+Concurrent queries against the same tile are coalesced into a single
+lookup.  TileMaskClient and ObjMaskClient provide the query interface
+of TileMask and ObjMask on top of a connection to the server.
+
+Start a server with
+
+    python -m desmasks.server --path /tmp/desmasks.sock
+
+and query it with
+
+    tmask = TileMaskClient('DES0000+0209', path='/tmp/desmasks.sock')
+    flags = tmask.get_mask_flags(ra, dec)
+
+Each message is a frame with a fixed size prefix holding the lengths of
+a JSON header and a binary payload.  Positions are sent as float64 ra
+followed by float64 dec, and pixels and objids as int64.  The header
+holds the number of values n, which the server checks against the size
+of the payload.
+"""
+
+import json
+import struct
+import functools
+import socket
+import asyncio
+import logging
+import collections
+import numpy as np
+
+from .masks import load_tile_mask
+from .objmasks import ObjMask
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = struct.Struct('<II')
+
+TILE_METHODS = ('is_masked', 'get_mask_flags')
+TILE_PIX_METHODS = ('is_masked_pix', 'get_mask_flags_pix')
+OBJ_METHODS = ('is_masked', 'get_mask_flags')
+
+
+class MaskServer(object):
+    """
+    asyncio server holding a cache of tile and object masks
+
+    Parameters
+    ----------
+    max_tiles: int, optional
+        Maximum number of tile masks to keep loaded, default 16
+    nthreads: int, optional
+        Number of threads used for loading masks and running
+        lookups, default 4
+    tile_geoms: mapping, optional
+        Tile geometry keyed by tilename.  Tiles found here use analytic
+        bounds and their bounds files are not read.  See load_tile_mask
+    """
+    def __init__(self, max_tiles=16, nthreads=4, tile_geoms=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._max_tiles = max_tiles
+        self._tile_geoms = {} if tile_geoms is None else tile_geoms
+        self._executor = ThreadPoolExecutor(max_workers=nthreads)
+
+        # these hold futures so concurrent requests share a single load
+        self._tiles = collections.OrderedDict()
+        self._objmasks = {}
+
+        # pending tile queries, keyed by (tilename, with_uvista)
+        self._batches = {}
+
+    async def serve_unix(self, path):
+        """
+        serve on a unix socket until cancelled
+
+        Parameters
+        ----------
+        path: string
+            Path for the socket
+        """
+        server = await asyncio.start_unix_server(self._handle, path=path)
+        logger.info('serving on %s', path)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_tcp(self, port, host='127.0.0.1'):
+        """
+        serve on a TCP port until cancelled
+
+        Parameters
+        ----------
+        port: int
+            Port to listen on
+        host: string, optional
+            Host to listen on, default 127.0.0.1
+        """
+        server = await asyncio.start_server(self._handle, host=host, port=port)
+        logger.info('serving on %s:%d', host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        """
+        handle requests on a single connection until it is closed
+        """
+        try:
+            while True:
+                try:
+                    header, payload = await _read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+
+                try:
+                    result = await self._dispatch(header, payload)
+                    rheader = {
+                        'status': 'ok',
+                        'dtype': result.dtype.str,
+                    }
+                    rpayload = result.tobytes()
+                except Exception as err:
+                    logger.exception('error processing request')
+                    rheader = {'status': 'error', 'message': repr(err)}
+                    rpayload = b''
+
+                writer.write(_make_frame(rheader, rpayload))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, header, payload):
+        kind = header['kind']
+        method = header['method']
+
+        if kind == 'tile':
+            key = (header['tilename'], header.get('with_uvista', False))
+
+            if method == 'nside':
+                tmask = await self._get_tile(key)
+                return np.array([tmask.nside], dtype='i8')
+
+            elif method in TILE_METHODS:
+                data = _get_payload_array(header, payload, '<f8', 2)
+                n = data.size//2
+                return await self._query_tile(
+                    key, (method, None), (data[:n], data[n:]),
+                )
+
+            elif method in TILE_PIX_METHODS:
+                pixels = _get_payload_array(header, payload, '<i8', 1)
+                nside = header.get('nside')
+                return await self._query_tile(
+                    key, (method, nside), (pixels, ),
+                )
+
+            else:
+                raise ValueError('bad tile method %s' % method)
+
+        elif kind == 'obj':
+            if method not in OBJ_METHODS:
+                raise ValueError('bad obj method %s' % method)
+
+            objids = _get_payload_array(header, payload, '<i8', 1)
+            objmask = await self._get_objmask(header['fname'])
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, getattr(objmask, method), objids,
+            )
+
+        else:
+            raise ValueError('bad request kind %s' % kind)
+
+    async def _get_tile(self, key):
+        """
+        get the tile mask from the cache, loading it if needed
+        """
+        future = self._tiles.get(key)
+        if future is None:
+            tilename, with_uvista = key
+            tile_geom = self._tile_geoms.get(tilename)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor,
+                lambda: load_tile_mask(
+                    tilename=tilename,
+                    with_uvista=with_uvista,
+                    tile_geom=tile_geom,
+                ),
+            )
+            self._tiles[key] = future
+
+            while len(self._tiles) > self._max_tiles:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+
+        try:
+            return await future
+        except Exception:
+            # don't cache failures
+            if self._tiles.get(key) is future:
+                del self._tiles[key]
+            raise
+
+    async def _get_objmask(self, fname):
+        """
+        get the object mask from the cache, loading it if needed
+        """
+        future = self._objmasks.get(fname)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, ObjMask, fname)
+            self._objmasks[fname] = future
+
+        try:
+            return await future
+        except Exception:
+            if self._objmasks.get(fname) is future:
+                del self._objmasks[fname]
+            raise
+
+    async def _query_tile(self, key, group, arrays):
+        """
+        queue the query; all queries for the tile that arrive before the
+        batch is processed are run as a single lookup for each group of
+        (method, nside)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            loop.create_task(self._run_batch(key))
+
+        batch.append((group, arrays, future))
+        return await future
+
+    async def _run_batch(self, key):
+        try:
+            tmask = await self._get_tile(key)
+        except Exception as err:
+            for group, arrays, future in self._batches.pop(key):
+                _set_exception(future, err)
+            return
+
+        # requests arriving from here on start a new batch
+        batch = self._batches.pop(key)
+
+        bygroup = collections.defaultdict(list)
+        for entry in batch:
+            bygroup[entry[0]].append(entry)
+
+        loop = asyncio.get_running_loop()
+        for (method, nside), entries in bygroup.items():
+            # any failure is sent to every client in the group, so none
+            # are left waiting
+            try:
+                narrays = len(entries[0][1])
+                arrays = [
+                    np.concatenate([entry[1][i] for entry in entries])
+                    for i in range(narrays)
+                ]
+
+                func = getattr(tmask, method)
+                if method in TILE_PIX_METHODS:
+                    func = functools.partial(func, nside=nside)
+
+                result = await loop.run_in_executor(
+                    self._executor, func, *arrays,
+                )
+
+                sizes = [entry[1][0].size for entry in entries]
+                results = np.split(result, np.cumsum(sizes)[:-1])
+                for entry, eresult in zip(entries, results):
+                    _set_result(entry[2], eresult)
+            except Exception as err:
+                for entry in entries:
+                    _set_exception(entry[2], err)
+
+
+class MaskClient(object):
+    """
+    blocking connection to a MaskServer
+
+    Parameters
+    ----------
+    path: string, optional
+        Path to the unix socket of the server
+    port: int, optional
+        TCP port of the server, used if path is not sent
+    host: string, optional
+        Host for TCP connections, default 127.0.0.1
+    """
+    def __init__(self, path=None, port=None, host='127.0.0.1'):
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        elif port is not None:
+            self._sock = socket.create_connection((host, port))
+        else:
+            raise ValueError('send path= or port=')
+
+    def query_tile(self, tilename, method, ra, dec, with_uvista=False):
+        """
+        run a query against a tile mask
+
+        Parameters
+        ----------
+        tilename: string
+            The tilename, either basic or with reqnum/attnum
+        method: string
+            'is_masked' or 'get_mask_flags'
+        ra: array
+            array of ra values
+        dec: array
+            array of dec values
+        with_uvista: bool, optional
+            If True, use the mask including UltraVISTA
+        """
+        shape = np.shape(ra)
+        ra = np.asarray(ra, dtype='<f8').ravel()
+        dec = np.asarray(dec, dtype='<f8').ravel()
+        if ra.size != dec.size:
+            raise ValueError('ra and dec must be the same size, '
+                             'got %d and %d' % (ra.size, dec.size))
+
+        header = {
+            'kind': 'tile',
+            'method': method,
+            'tilename': tilename,
+            'with_uvista': with_uvista,
+            'n': ra.size,
+        }
+        return self._query(header, ra.tobytes() + dec.tobytes(), shape=shape)
+
+    def query_tile_pix(self, tilename, method, pixels, nside=None,
+                       with_uvista=False):
+        """
+        run a pixel query against a tile mask
+
+        Parameters
+        ----------
+        tilename: string
+            The tilename, either basic or with reqnum/attnum
+        method: string
+            'is_masked_pix' or 'get_mask_flags_pix'
+        pixels: array
+            Nest pixel indices
+        nside: int, optional
+            nside of the pixels, default the nside of the mask map
+        with_uvista: bool, optional
+            If True, use the mask including UltraVISTA
+        """
+        shape = np.shape(pixels)
+        pixels = np.asarray(pixels, dtype='<i8').ravel()
+        if nside is not None:
+            nside = int(nside)
+
+        header = {
+            'kind': 'tile',
+            'method': method,
+            'tilename': tilename,
+            'with_uvista': with_uvista,
+            'nside': nside,
+            'n': pixels.size,
+        }
+        return self._query(header, pixels.tobytes(), shape=shape)
+
+    def get_tile_nside(self, tilename, with_uvista=False):
+        """
+        get the nside of the mask map for a tile
+        """
+        header = {
+            'kind': 'tile',
+            'method': 'nside',
+            'tilename': tilename,
+            'with_uvista': with_uvista,
+        }
+        return int(self._query(header, b'')[0])
+
+    def query_obj(self, fname, method, objids):
+        """
+        run a query against an object mask
+
+        Parameters
+        ----------
+        fname: string
+            The object mask file, as sent to ObjMask
+        method: string
+            'is_masked' or 'get_mask_flags'
+        objids: array
+            array of object ids
+        """
+        objids = np.asarray(objids, dtype='<i8').ravel()
+        header = {
+            'kind': 'obj',
+            'method': method,
+            'fname': fname,
+            'n': objids.size,
+        }
+        return self._query(header, objids.tobytes())
+
+    def close(self):
+        """
+        close the connection
+        """
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _query(self, header, payload, shape=None):
+        self._sock.sendall(_make_frame(header, payload))
+
+        prefix = _recv_exactly(self._sock, _PREFIX.size)
+        hlen, plen = _PREFIX.unpack(prefix)
+        rheader = json.loads(bytes(_recv_exactly(self._sock, hlen)))
+        rpayload = _recv_exactly(self._sock, plen)
+
+        if rheader['status'] != 'ok':
+            raise RuntimeError('mask server error: %s' % rheader['message'])
+
+        # the payload is a bytearray, so the result is writeable
+        result = np.frombuffer(rpayload, dtype=rheader['dtype'])
+        if shape is not None:
+            # match the input shape, with scalars for scalar input as
+            # returned by TileMask
+            result = result.reshape(shape)
+            if result.ndim == 0:
+                result = result[()]
+
+        return result
+
+
+class TileMaskClient(object):
+    """
+    TileMask query interface backed by a MaskServer
+
+    Parameters
+    ----------
+    tilename: string
+        The tilename, either basic or with reqnum/attnum
+    with_uvista: bool, optional
+        If True, use the mask including UltraVISTA
+    client: MaskClient, optional
+        An existing connection.  If not sent, a new connection is
+        made using the remaining keywords
+    **kw:
+        keywords for MaskClient
+    """
+    def __init__(self, tilename, with_uvista=False, client=None, **kw):
+        if client is None:
+            client = MaskClient(**kw)
+
+        self._tilename = tilename
+        self._with_uvista = with_uvista
+        self._client = client
+        self._nside = None
+
+    def is_masked(self, ra, dec):
+        """
+        check if the input positions are masked
+        """
+        return self._client.query_tile(
+            self._tilename, 'is_masked', ra, dec,
+            with_uvista=self._with_uvista,
+        )
+
+    def is_unmasked(self, ra, dec):
+        """
+        check if the input positions are unmasked
+        """
+        return ~self.is_masked(ra, dec)
+
+    def get_mask_flags(self, ra, dec):
+        """
+        get mask values (not from bounds)
+        """
+        return self._client.query_tile(
+            self._tilename, 'get_mask_flags', ra, dec,
+            with_uvista=self._with_uvista,
+        )
+
+    @property
+    def nside(self):
+        """
+        get the nside of the mask map
+        """
+        if self._nside is None:
+            self._nside = self._client.get_tile_nside(
+                self._tilename, with_uvista=self._with_uvista,
+            )
+        return self._nside
+
+    def is_masked_pix(self, pixels, nside=None):
+        """
+        check if the input nest pixels are masked
+        """
+        return self._client.query_tile_pix(
+            self._tilename, 'is_masked_pix', pixels, nside=nside,
+            with_uvista=self._with_uvista,
+        )
+
+    def is_unmasked_pix(self, pixels, nside=None):
+        """
+        check if the input nest pixels are unmasked
+        """
+        return ~self.is_masked_pix(pixels, nside=nside)
+
+    def get_mask_flags_pix(self, pixels, nside=None):
+        """
+        get mask values (not from bounds) for the input nest pixels
+        """
+        return self._client.query_tile_pix(
+            self._tilename, 'get_mask_flags_pix', pixels, nside=nside,
+            with_uvista=self._with_uvista,
+        )
+
+
+class ObjMaskClient(object):
+    """
+    ObjMask query interface backed by a MaskServer
+
+    Parameters
+    ----------
+    fname: string
+        The object mask file; it is read by the server
+    client: MaskClient, optional
+        An existing connection.  If not sent, a new connection is
+        made using the remaining keywords
+    **kw:
+        keywords for MaskClient
+    """
+    def __init__(self, fname, client=None, **kw):
+        if client is None:
+            client = MaskClient(**kw)
+
+        self._fname = fname
+        self._client = client
+
+    def is_masked(self, objids):
+        """
+        check if the input objids is in the mask
+        """
+        return self._client.query_obj(self._fname, 'is_masked', objids)
+
+    def is_unmasked(self, objids):
+        """
+        check if the input objids is not in the mask
+        """
+        return ~self.is_masked(objids)
+
+    def get_mask_flags(self, objids):
+        """
+        get mask values
+        """
+        return self._client.query_obj(self._fname, 'get_mask_flags', objids)
+
+
+def run_server(path=None, port=None, host='127.0.0.1', **kw):
+    """
+    run a MaskServer until interrupted
+
+    Parameters
+    ----------
+    path: string, optional
+        Path for a unix socket
+    port: int, optional
+        TCP port, used if path is not sent
+    host: string, optional
+        Host for TCP, default 127.0.0.1
+    **kw:
+        keywords for MaskServer
+    """
+    server = MaskServer(**kw)
+    if path is not None:
+        coro = server.serve_unix(path)
+    elif port is not None:
+        coro = server.serve_tcp(port, host=host)
+    else:
+        raise ValueError('send path= or port=')
+
+    try:
+        asyncio.run(coro)
+    except KeyboardInterrupt:
+        pass
+
+
+def _set_result(future, result):
+    """
+    set the result unless the future is already done, e.g. cancelled
+    when the client disconnected
+    """
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, err):
+    """
+    set the exception unless the future is already done
+    """
+    if not future.done():
+        future.set_exception(err)
+
+
+def _get_payload_array(header, payload, dtype, ncol):
+    """
+    get the payload as an array, checking it holds ncol columns of
+    header['n'] values
+    """
+    n = header.get('n')
+    if n is None:
+        raise ValueError('request header is missing n')
+
+    itemsize = np.dtype(dtype).itemsize
+    if len(payload) != ncol*itemsize*n:
+        raise ValueError(
+            'payload has %d bytes, expected %d for %d columns of %d '
+            'values' % (len(payload), ncol*itemsize*n, ncol, n)
+        )
+
+    return np.frombuffer(payload, dtype=dtype)
+
+
+async def _read_frame(reader):
+    prefix = await reader.readexactly(_PREFIX.size)
+    hlen, plen = _PREFIX.unpack(prefix)
+    header = json.loads(await reader.readexactly(hlen))
+    payload = await reader.readexactly(plen)
+    return header, payload
+
+
+def _make_frame(header, payload):
+    hbytes = json.dumps(header).encode('utf-8')
+    return _PREFIX.pack(len(hbytes), len(payload)) + hbytes + payload
+
+
+def _recv_exactly(sock, n):
+    buff = bytearray(n)
+    view = memoryview(buff)
+    nread = 0
+    while nread < n:
+        nrecv = sock.recv_into(view[nread:], n - nread)
+        if nrecv == 0:
+            raise ConnectionError('mask server closed the connection')
+        nread += nrecv
+
+    return buff
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='serve desmasks queries')
+    parser.add_argument('--path', help='path for a unix socket')
+    parser.add_argument('--port', type=int, help='TCP port on localhost')
+    parser.add_argument('--max-tiles', type=int, default=16,
+                        help='maximum number of tiles to keep loaded')
+    parser.add_argument('--nthreads', type=int, default=4,
+                        help='number of threads for loading and lookups')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run_server(
+        path=args.path,
+        port=args.port,
+        max_tiles=args.max_tiles,
+        nthreads=args.nthreads,
+    )
+
+
+if __name__ == '__main__':
+    main()